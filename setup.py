@@ -21,6 +21,15 @@ setup(
         'numpy',
         'pandas',
     ],
+    extras_require={
+        'numexpr': ['numexpr'],
+        'excel': ['openpyxl'],
+    },
+    entry_points={
+        'console_scripts': [
+            'stata-py=stata_py.cli:main',
+        ],
+    },
     python_requires='>=3.11',
 )
 
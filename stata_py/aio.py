@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio counterparts of tab, table, count and to_excel.
+
+The work runs on an executor (the default thread pool of the event loop if
+none is configured), at most max_concurrency computations at a time. Identical
+requests in flight (same function, same DataFrame objects and same arguments)
+are coalesced into a single computation, each caller receives its own copy of
+the resulting DataFrame.
+
+example:
+    from stata_py import aio
+
+    aio.configure(max_concurrency=4)
+    t = await aio.table(df, "continent", stats="mean lifeExp", if_stata="year >= 2000")
+"""
+import asyncio
+import functools
+import weakref
+import pandas as pd
+from concurrent.futures import Executor
+from typing import Union, List
+from . import stats
+
+# Executor and concurrency limit used by the async functions
+_executor = None
+_max_concurrency = None
+
+# Semaphore limiting the computations of each event loop
+_semaphores = weakref.WeakKeyDictionary()
+
+# Computations in flight, by event loop and request
+_inflight = {}
+
+# The stats parameter of table shadows the stats module inside table
+_table = stats.table
+
+
+def configure(executor: Executor = None,
+              max_concurrency: int = None) -> None:
+    """
+    Function that configures where and how many computations run at a time.
+    ----------
+    executor : concurrent.futures.Executor, optional (default=None)
+        ThreadPoolExecutor or ProcessPoolExecutor to run the computations.
+        None uses the default executor of the event loop.
+    max_concurrency : int, optional (default=None)
+        Maximum number of computations running at a time in each event loop.
+        None does not limit them beyond the executor.
+    Returns
+    -------
+    None
+    """
+    global _executor, _max_concurrency
+    if max_concurrency is not None and max_concurrency < 1:
+        raise ValueError("max_concurrency must be a positive integer")
+    _executor = executor
+    _max_concurrency = max_concurrency
+    _semaphores.clear()
+
+
+def _semaphore(loop):
+    # Semaphore of the event loop, created with the current limit
+    if _max_concurrency is None:
+        return None
+    if loop not in _semaphores:
+        _semaphores[loop] = asyncio.Semaphore(_max_concurrency)
+    return _semaphores[loop]
+
+
+def _key(value):
+    # Hashable identification of an argument, DataFrames and Series by identity
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return ('id', id(value))
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__,) + tuple(_key(v) for v in value)
+    try:
+        hash(value)
+    except TypeError:
+        return ('id', id(value))
+    return value
+
+
+class _Shared:
+    # Computation shared by the callers waiting for the same request
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+async def _compute(loop, function, kwargs):
+    semaphore = _semaphore(loop)
+    call = functools.partial(function, **kwargs)
+    if semaphore is None:
+        return await loop.run_in_executor(_executor, call)
+
+    await semaphore.acquire()
+    try:
+        future = loop.run_in_executor(_executor, call)
+    except BaseException:
+        semaphore.release()
+        raise
+
+    def release(f):
+        # The executor keeps running a cancelled request, so the slot is only
+        # released when the call actually finishes
+        if not f.cancelled():
+            f.exception()
+        semaphore.release()
+    future.add_done_callback(release)
+
+    return await asyncio.shield(future)
+
+
+async def _run(function, **kwargs):
+    """
+    Function that runs function(**kwargs) in the executor, coalescing it with
+    an identical request in flight. Each caller receives its own copy of a
+    DataFrame result, so callers can modify it without affecting the others.
+    Cancelling a caller only cancels the computation when no other caller is
+    waiting for it; a computation already running in the executor finishes,
+    but its result is discarded.
+    """
+    loop = asyncio.get_running_loop()
+    key = (loop, function.__name__, tuple((k, _key(v)) for k, v in sorted(kwargs.items())))
+
+    shared = _inflight.get(key)
+    if shared is None:
+        shared = _Shared(loop.create_task(_compute(loop, function, kwargs)))
+        _inflight[key] = shared
+
+        def done(task):
+            if _inflight.get(key) is shared:
+                del _inflight[key]
+        shared.task.add_done_callback(done)
+
+    shared.waiters += 1
+    try:
+        result = await asyncio.shield(shared.task)
+    except asyncio.CancelledError:
+        if shared.waiters == 1:
+            # Later identical requests must start a new computation
+            if _inflight.get(key) is shared:
+                del _inflight[key]
+            shared.task.cancel()
+        raise
+    finally:
+        shared.waiters -= 1
+
+    if isinstance(result, pd.DataFrame):
+        return result.copy()
+    return result
+
+
+async def tab(df: pd.DataFrame,
+              col: Union[str, List[str]],
+              nofreq: bool = False,
+              sort: bool = False,
+              round_decimals: int = 2,
+              reset_index: bool = True,
+              missing: bool = False,
+              total: bool = False,
+              if_stata: str = None,
+              percent: str = None,
+              w: pd.Series = None,
+              engine: str = None) -> pd.DataFrame:
+    """
+    Async counterpart of stats.tab, see stats.tab for the parameters.
+    """
+    return await _run(stats.tab, df=df, col=col, nofreq=nofreq, sort=sort,
+                      round_decimals=round_decimals, reset_index=reset_index,
+                      missing=missing, total=total, if_stata=if_stata,
+                      percent=percent, w=w, engine=engine)
+
+
+async def table(df: pd.DataFrame,
+                var: Union[str, List[str]],
+                stats: str,
+                pivot:bool = True,
+                round_decimals: int = 2,
+                if_stata: str = None,
+                w: pd.Series = None,
+                engine: str = None) -> pd.DataFrame:
+    """
+    Async counterpart of stats.table, see stats.table for the parameters.
+    """
+    return await _run(_table, df=df, var=var, stats=stats, pivot=pivot,
+                      round_decimals=round_decimals, if_stata=if_stata,
+                      w=w, engine=engine)
+
+
+async def count(df: pd.DataFrame,
+                if_stata: str = None,
+                engine: str = None) -> int:
+    """
+    Async counterpart of stats.count, see stats.count for the parameters.
+    """
+    return await _run(stats.count, df=df, if_stata=if_stata, engine=engine)
+
+
+async def to_excel(data: Union[pd.DataFrame,
+                        List[pd.DataFrame]], path: str,
+                        sheet_names: List[str] = None) -> None:
+    """
+    Async counterpart of stats.to_excel, see stats.to_excel for the parameters.
+    """
+    return await _run(stats.to_excel, data=data, path=path, sheet_names=sheet_names)
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Command line entry point ``stata-py`` to run tab, table and count over a file.
+
+Only argparse is imported at startup, pandas and the rest of stata_py are
+imported when a command runs, and openpyxl only when writing Excel files.
+
+examples:
+    stata-py tab data.csv continent --if "year >= 2000"
+    stata-py tab data.dta continent year --percent row --format csv
+    stata-py table data.parquet continent --stats "mean lifeExp p90 gdpPercap"
+    stata-py count data.csv --if "(pop > 100000000) | (lifeExp > 80)"
+"""
+import argparse
+import re
+import sys
+
+# Extras of stata_py that install the optional dependencies
+_EXTRAS = {'numexpr': 'numexpr', 'openpyxl': 'excel'}
+
+
+def read_data(path: str,
+              columns: list = None):
+    """
+    Function that reads a file into a pandas DataFrame according to its extension.
+    ----------
+    path : str
+        Path of the file, can be .csv, .dta, .parquet, .feather, .pkl, .xlsx or .xls.
+    columns : list, optional (default=None)
+        Columns to read, if the format allows it. None reads all the columns.
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame with the data of the file.
+    """
+    import pandas as pd
+
+    extension = path.lower().rsplit('.', 1)[-1]
+    if extension == 'csv':
+        return pd.read_csv(path, usecols=columns)
+    elif extension == 'dta':
+        return pd.read_stata(path, columns=columns)
+    elif extension == 'parquet':
+        return pd.read_parquet(path, columns=columns)
+    elif extension == 'feather':
+        return pd.read_feather(path, columns=columns)
+    elif extension in ('xlsx', 'xls'):
+        return pd.read_excel(path, usecols=columns)
+    elif extension in ('pkl', 'pickle'):
+        df = pd.read_pickle(path)
+        return df[columns] if columns else df
+    else:
+        raise ValueError(f"Unrecognized file format: {path}")
+
+
+def _condition_columns(if_stata: str) -> list:
+    # Candidate column names used in a Stata condition, quoted strings excluded
+    if not if_stata:
+        return []
+    text = re.sub(r"'[^']*'|\"[^\"]*\"", ' ', if_stata)
+    names = re.findall(r'[A-Za-z_]\w*', text)
+    return [n for n in names if n not in ('inlist', 'inrange')]
+
+
+def _columns(header: list,
+             needed: list) -> list:
+    # Keep the needed columns that exist in the file, in the order of the file
+    needed = set(needed)
+    return [c for c in header if c in needed]
+
+
+def _header(path: str) -> list:
+    # Column names of the file without reading the data, None if not available
+    import pandas as pd
+
+    extension = path.lower().rsplit('.', 1)[-1]
+    if extension == 'csv':
+        return list(pd.read_csv(path, nrows=0).columns)
+    if extension == 'dta':
+        with pd.read_stata(path, iterator=True) as reader:
+            return list(reader.variable_labels())
+    return None
+
+
+def _write(result,
+           output_format: str,
+           output: str) -> None:
+    # Write a DataFrame (or a count) in the requested format
+    import pandas as pd
+
+    # A count is written to Excel as a one-cell table
+    if not isinstance(result, pd.DataFrame) and output_format == 'excel':
+        result = pd.DataFrame({'N': [result]})
+
+    if not isinstance(result, pd.DataFrame):
+        text = str(result)
+        if output:
+            with open(output, 'w') as f:
+                f.write(text + '\n')
+        else:
+            print(text)
+        return
+
+    if output_format == 'excel':
+        if not output:
+            raise ValueError("--format excel requires --output")
+        from .stats import to_excel
+        to_excel(result, output)
+        return
+
+    if output_format == 'csv':
+        text = result.to_csv(index=False)
+    elif output_format == 'json':
+        text = result.to_json(orient='records')
+    else:
+        text = result.to_string(index=False)
+
+    if output:
+        with open(output, 'w') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text if text.endswith('\n') else text + '\n')
+
+
+def _run_tab(args):
+    from .stats import tab
+
+    df = _load(args, args.var)
+    col = args.var if len(args.var) == 2 else args.var[0]
+    result = tab(df, col, nofreq=args.nofreq, sort=args.sort,
+                 round_decimals=args.round, missing=args.missing,
+                 total=args.total, if_stata=args.if_stata,
+                 percent=args.percent, engine=args.engine)
+    if len(args.var) == 2:
+        result = result.reset_index()
+    return result
+
+
+def _run_table(args):
+    from .stats import table
+
+    df = _load(args, args.var + args.stats.split())
+    var = args.var if len(args.var) == 2 else args.var[0]
+    result = table(df, var, args.stats, pivot=not args.no_pivot,
+                   round_decimals=args.round, if_stata=args.if_stata,
+                   engine=args.engine)
+    if len(args.var) == 2 and not args.no_pivot:
+        result = result.reset_index()
+    return result
+
+
+def _run_count(args):
+    from .stats import count
+
+    df = _load(args, [])
+    return count(df, if_stata=args.if_stata, engine=args.engine)
+
+
+def _load(args,
+          needed: list):
+    # Read only the columns used by the command when the file format allows it
+    header = _header(args.path)
+    if header is None:
+        return read_data(args.path)
+    columns = _columns(header, list(needed) + _condition_columns(args.if_stata))
+    return read_data(args.path, columns=columns or header[:1])
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog='stata-py',
+        description='Stata style tabulations over a data file.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('path', help='data file (.csv, .dta, .parquet, .feather, .pkl, .xlsx)')
+    common.add_argument('--if', dest='if_stata', default=None,
+                        help='condition with Stata syntax, e.g. "year >= 2000 & continent == \'Asia\'"')
+    common.add_argument('--engine', default=None, choices=['numexpr'],
+                        help='backend to evaluate --if')
+    common.add_argument('--format', dest='format', default='text',
+                        choices=['text', 'csv', 'json', 'excel'],
+                        help='output format (default: text)')
+    common.add_argument('-o', '--output', default=None,
+                        help='output file, stdout if omitted')
+
+    p = commands.add_parser('tab', parents=[common],
+                            help='frequencies of one variable or crosstab of two')
+    p.add_argument('var', nargs='+', help='one or two variables')
+    p.add_argument('--percent', choices=['col', 'row', 'cell'], default=None)
+    p.add_argument('--nofreq', action='store_true')
+    p.add_argument('--sort', action='store_true')
+    p.add_argument('--missing', action='store_true')
+    p.add_argument('--total', action='store_true')
+    p.add_argument('--round', type=int, default=2)
+    p.set_defaults(run=_run_tab)
+
+    p = commands.add_parser('table', parents=[common],
+                            help='statistics by one or two variables')
+    p.add_argument('var', nargs='+', help='one or two variables')
+    p.add_argument('--stats', required=True, help='statistics, e.g. "mean x p90 y"')
+    p.add_argument('--no-pivot', action='store_true')
+    p.add_argument('--round', type=int, default=2)
+    p.set_defaults(run=_run_table)
+
+    p = commands.add_parser('count', parents=[common],
+                            help='number of rows satisfying --if')
+    p.set_defaults(run=_run_count)
+
+    return parser
+
+
+def main(argv: list = None) -> int:
+    """
+    Entry point of the ``stata-py`` command.
+    ----------
+    argv : list, optional (default=None)
+        Command line arguments, sys.argv[1:] if None.
+    Returns
+    -------
+    int
+        Exit status.
+    """
+    parser = _parser()
+    args = parser.parse_args(argv)
+
+    if args.command in ('tab', 'table') and len(args.var) > 2:
+        parser.error("var must be one or two variables")
+
+    try:
+        result = args.run(args)
+        _write(result, args.format, args.output)
+    except ImportError as e:
+        module = (e.name or '').split('.')[0]
+        message = f"stata-py: error: {e}"
+        if module in _EXTRAS:
+            message += f"\ninstall it with: pip install 'stata_py[{_EXTRAS[module]}]'"
+        print(message, file=sys.stderr)
+        return 1
+    except (ValueError, KeyError, TypeError, OSError) as e:
+        print(f"stata-py: error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,37 +4,51 @@ Created on Wed Aug 16 16:06:11 2023
 
 @author: UCHILE
 """
+import numpy as np
 import pandas as pd
 import re
+import threading
 
-def condition(df: pd.DataFrame, 
-              stata_condition: str) -> pd.Series:
+# Prior fraction of rows expected to satisfy each kind of individual condition,
+# used to order the conditions before any of them has been observed
+_PRIOR_SELECTIVITY = {
+    '==': 0.1,
+    'inlist': 0.1,
+    'inrange': 0.3,
+    '<': 0.5,
+    '<=': 0.5,
+    '>': 0.5,
+    '>=': 0.5,
+    '!=': 0.9,
+}
+
+# Fraction of rows observed to satisfy each condition in previous evaluations
+_observed_selectivity = {}
+_MAX_OBSERVED = 1024
+# Evaluations may run in several threads at a time (see aio)
+_observed_lock = threading.Lock()
+
+def _parse_condition(stata_condition: str):
     """
-    Función que evalua condiciones logicas individuales sobre un dataframe,
-    considera como validas condiciones <,=<,>,>=,==,inlist(),inrange()
-    Parameters
+    Function that parses an individual logical condition with Stata syntax.
     ----------
-    df : pd.DataFrame
-        dataframe a evular condiciones.
     stata_condition : str
         condicion logica con la sintaxis de Stata, puede procesar las condiciones:
             <,=<,>,>=,==,inlist(),inrange().
-        ejemplos stata_condition = "year == 1978", "year >= 1978", 
-        "inlist(country,"Chile","Argentina)"
     Returns
     -------
-    pd.Series
-        Serie booleana de condicion evaluada
-
+    tuple
+        (column, kind, function, values) where function evaluates the condition
+        over the pd.Series of the column, kind identifies the type of condition
+        and values are the values the column is compared with.
     """
-    # Create a copy of the original DataFrame
-    df = df.copy()
 
     # Case for inrange
     inrange_match = re.search(r"\s*inrange\(\s*(\w+)\s*,\s*([\d\w]+)\s*,\s*([\d\w]+)\s*\)\s*", stata_condition)
     if inrange_match:
         column, lower, upper = inrange_match.groups()
-        return (df[column] >= float(lower)) & (df[column] <= float(upper))
+        lower, upper = float(lower), float(upper)
+        return column, 'inrange', lambda s: (s >= lower) & (s <= upper), (lower, upper)
 
     # Case for inlist
     inlist_match = re.match(r"\s*inlist\(\s*(\w+)\s*,\s*(.*?)\s*\)", stata_condition)
@@ -44,7 +58,7 @@ def condition(df: pd.DataFrame,
         values = [value.strip().strip("'") for value in values.split(',')]
         # Try to convert each value to an integer; if not possible, leave it as is (as a string)
         values = [float(value) if value.isdigit() else value for value in values]
-        return df[column].isin(values)
+        return column, 'inlist', lambda s: s.isin(values), tuple(values)
 
     # Case for simple comparisons
     match = re.match(r"\s*(\w+)\s*([<>==!]+)\s*(.+)\s*", stata_condition)
@@ -59,26 +73,171 @@ def condition(df: pd.DataFrame,
 
     # Apply the corresponding filter based on the operator
     if operator == '==':
-        return df[column] == value
+        return column, operator, lambda s: s == value, (value,)
     elif operator == '>=':
-        return df[column] >= value
+        return column, operator, lambda s: s >= value, (value,)
     elif operator == '<=':
-        return df[column] <= value
+        return column, operator, lambda s: s <= value, (value,)
     elif operator == '>':
-        return df[column] > value
+        return column, operator, lambda s: s > value, (value,)
     elif operator == '<':
-        return df[column] < value
+        return column, operator, lambda s: s < value, (value,)
     elif operator == '!=':
-        return df[column] != value
+        return column, operator, lambda s: s != value, (value,)
     else:
         raise ValueError(f"Unrecognized operator: {operator}")
 
+def condition(df: pd.DataFrame, 
+              stata_condition: str) -> pd.Series:
+    """
+    Función que evalua condiciones logicas individuales sobre un dataframe,
+    considera como validas condiciones <,=<,>,>=,==,inlist(),inrange()
+    Parameters
+    ----------
+    df : pd.DataFrame
+        dataframe a evular condiciones.
+    stata_condition : str
+        condicion logica con la sintaxis de Stata, puede procesar las condiciones:
+            <,=<,>,>=,==,inlist(),inrange().
+        ejemplos stata_condition = "year == 1978", "year >= 1978", 
+        "inlist(country,"Chile","Argentina)"
+    Returns
+    -------
+    pd.Series
+        Serie booleana de condicion evaluada
+
+    """
+    column, _, function, _ = _parse_condition(stata_condition)
+    return function(df[column])
+
+def _selectivity(key: str, 
+                 prior: float) -> float:
+    # Learned fraction of rows satisfying the condition, or the prior if never observed
+    return _observed_selectivity.get(key, prior)
+
+def _learn_selectivity(key: str, 
+                       passed: int, 
+                       evaluated: int) -> None:
+    # Blend the new observation with the previous ones
+    if not evaluated:
+        return
+    rate = passed / evaluated
+    with _observed_lock:
+        if key in _observed_selectivity:
+            rate = (_observed_selectivity[key] + rate) / 2
+        elif len(_observed_selectivity) >= _MAX_OBSERVED:
+            _observed_selectivity.clear()
+        _observed_selectivity[key] = rate
+
+def _short_circuit(terms: list, 
+                   operators: list, 
+                   n: int) -> np.ndarray:
+    """
+    Function that combines terms from left to right with the operators & and |,
+    evaluating each term only on the rows whose result is still undecided.
+    ----------
+    terms : list
+        list of (key, prior, function) where function receives an array of row
+        positions and returns a boolean array with the condition on those rows.
+    operators : list
+        operators & and | between consecutive terms.
+    n : int
+        number of rows.
+    Returns
+    -------
+    np.ndarray
+        Boolean array of the evaluated condition
+    """
+
+    # Group the terms in runs of the same operator, the order of the terms inside
+    # a run does not change the result: ((x & a) & b) == ((x & b) & a)
+    runs = []
+    for i, term in enumerate(terms):
+        operator = operators[i - 1] if i else (operators[0] if operators else '&')
+        if runs and runs[-1][0] == operator:
+            runs[-1][1].append(term)
+        else:
+            runs.append((operator, [term]))
+
+    # The first term is combined with True by & or with False by |
+    result = np.full(n, runs[0][0] == '&')
+
+    for operator, run in runs:
+        if operator == '&':
+            # Most selective conditions first, later ones only see the surviving rows
+            run = sorted(run, key=lambda t: _selectivity(t[0], t[1]))
+            for key, _, function in run:
+                rows = np.flatnonzero(result)
+                if not len(rows):
+                    break
+                mask = function(rows)
+                result[rows[~mask]] = False
+                _learn_selectivity(key, int(mask.sum()), len(rows))
+        else:
+            # Least selective conditions first, later ones only see the rows still False
+            run = sorted(run, key=lambda t: -_selectivity(t[0], t[1]))
+            for key, _, function in run:
+                rows = np.flatnonzero(~result)
+                if not len(rows):
+                    break
+                mask = function(rows)
+                result[rows[mask]] = True
+                _learn_selectivity(key, int(mask.sum()), len(rows))
+
+    return result
+
+def _atom(df: pd.DataFrame, 
+          stata_condition: str) -> tuple:
+    # Parse the condition and resolve its column up front, so that syntax errors
+    # and missing columns are raised even if the condition is never evaluated
+    key = re.sub(r'\s+', ' ', stata_condition).strip()
+    column, kind, function, _ = _parse_condition(stata_condition)
+    series = df[column]
+
+    # Ordering comparisons (<, >, inrange) raise TypeError depending on the dtype
+    # and the data (e.g. strings against numbers), evaluate them up front so the
+    # errors do not depend on the rows left by other conditions
+    mask = None
+    if kind not in ('==', '!=', 'inlist'):
+        if series.dtype.kind in 'biuf':
+            # Numeric columns only fail against strings, regardless of the data
+            function(series.iloc[:0])
+        else:
+            mask = function(series).to_numpy(dtype=bool, na_value=False)
+
+    def evaluate(rows):
+        # rows are positions in df
+        if mask is not None:
+            return mask[rows]
+        s = series if len(rows) == len(series) else series.iloc[rows]
+        return function(s).to_numpy(dtype=bool, na_value=False)
+
+    return key, _PRIOR_SELECTIVITY[kind], evaluate
+
+def _split_conditions(df: pd.DataFrame, 
+                      complex_condition: str) -> tuple:
+    # Parse the individual conditions and the operators between them
+    parts = re.split(r'\s*(&|\|)\s*', complex_condition)
+    conditions = parts[::2]  # The conditions are in even positions
+    operators = [o.strip() for o in parts[1::2]]  # The operators are in odd positions
+    return [_atom(df, c.strip()) for c in conditions], operators
+
+def _compile_conditions(atoms: list, 
+                        operators: list, 
+                        positions: np.ndarray) -> np.ndarray:
+    # Evaluate the parsed conditions over the rows in positions
+    terms = [(key, prior, lambda rows, f=function: f(positions[rows]))
+             for key, prior, function in atoms]
+    return _short_circuit(terms, operators, len(positions))
+
 def compile_conditions(df: pd.DataFrame, 
                        complex_condition: str) -> pd.Series:
     """
     Function that evaluates complex logical conditions, where there are operators & and
     |, divides into individual conditions, and evaluates them in the stata_condition function,
     then performs the corresponding |/& operations.
+    The most selective conditions are evaluated first, and each condition is only
+    evaluated on the rows that can still change the result.
     ----------
     df : pd.DataFrame
         DataFrame to evaluate conditions.
@@ -91,33 +250,89 @@ def compile_conditions(df: pd.DataFrame,
     pd.Series
         Boolean series of the evaluated complex condition
     """
-    
-    # Create a copy of the original DataFrame
-    df = df.copy()
-    # Split the complex condition into individual parts using logical operators
-    conditions = re.split(r'\s*(&|\|)\s*', complex_condition)
 
-    # Initialize the result as a series of True (to comply with all conditions)
-    result = pd.Series(True, index=df.index)
-    
-    # Split the complex condition into parts using a regular expression that identifies the operators
-    parts = re.split(r'\s*(&|\|)\s*', complex_condition)
-    conditions = parts[::2]  # The conditions are in even positions
-    operators = parts[1::2]  # The operators are in odd positions
-    
-    # Initialize the result with the first condition
-    result = condition(df, conditions[0].strip())
-    
-    # Iterate through the remaining conditions and operators, applying each operator with its corresponding condition
-    for i in range(len(operators)):
-        condition_result = condition(df, conditions[i + 1].strip())
-        operator = operators[i].strip()
-        if operator == '&':
-            result &= condition_result
-        elif operator == '|':
-            result |= condition_result
+    atoms, operators = _split_conditions(df, complex_condition)
+    result = _compile_conditions(atoms, operators, np.arange(len(df)))
+    return pd.Series(result, index=df.index)
 
-    return result
+
+# Column dtypes that numexpr evaluates natively
+_NUMEXPR_DTYPES = {np.dtype(t) for t in ['int8', 'int16', 'int32', 'int64',
+                                          'uint8', 'uint16', 'uint32',
+                                          'float32', 'float64']}
+
+# numexpr handles at most this many input arrays in a single expression
+_NUMEXPR_MAX_INPUTS = 31
+
+def _numexpr_condition(df: pd.DataFrame, 
+                       parts: list, 
+                       operators: list) -> np.ndarray:
+    """
+    Function that translates the () blocks of a complex condition into a single
+    numexpr expression, evaluated in cache-sized blocks with multiple threads
+    without allocating a temporary mask for each individual condition.
+    Only conditions where every individual condition compares a numeric column
+    with numbers are translated. Conditions over strings or other dtypes are
+    left to the default evaluator, which only evaluates them on the rows still
+    undecided by the other conditions.
+    ----------
+    df : pd.DataFrame
+        DataFrame to evaluate conditions.
+    parts : list
+        () blocks of the complex condition.
+    operators : list
+        operators & and | between the blocks.
+    Returns
+    -------
+    np.ndarray
+        Boolean array of the evaluated condition, or None if the condition is
+        not purely numeric or needs more input arrays than numexpr can handle.
+    """
+    try:
+        import numexpr
+    except ImportError:
+        raise ImportError("engine='numexpr' requires the numexpr package",
+                          name='numexpr') from None
+
+    names = {}
+
+    def term(stata_condition):
+        # numexpr expression of the condition, None if it can not be translated
+        column, kind, function, values = _parse_condition(stata_condition)
+        if df[column].dtype not in _NUMEXPR_DTYPES:
+            return None
+        if not all(isinstance(v, float) for v in values):
+            return None
+        # Each column enters the expression only once
+        if column not in names:
+            names[column] = f'x{len(names)}'
+        name = names[column]
+        if kind == 'inrange':
+            return f'(({name} >= {values[0]!r}) & ({name} <= {values[1]!r}))'
+        if kind == 'inlist':
+            return '(' + ' | '.join(f'({name} == {v!r})' for v in values) + ')'
+        return f'({name} {kind} {values[0]!r})'
+
+    def fold(terms, ops):
+        # Combine from left to right, as in compile_conditions
+        expression = terms[0]
+        for o, t in zip(ops, terms[1:]):
+            expression = f'({expression} {o} {t})'
+        return expression
+
+    blocks = []
+    for p in parts:
+        split = re.split(r'\s*(&|\|)\s*', p)
+        terms = [term(c.strip()) for c in split[::2]]
+        if None in terms:
+            return None
+        blocks.append(fold(terms, [o.strip() for o in split[1::2]]))
+
+    if len(names) > _NUMEXPR_MAX_INPUTS:
+        return None
+
+    local_dict = {name: df[column].to_numpy() for column, name in names.items()}
+    return numexpr.evaluate(fold(blocks, operators), local_dict=local_dict)
 
 
 def clear_text(text, sec):
@@ -162,7 +377,8 @@ def normalize_text(text):
     return norm_text
 
 def evaluate_condition(df: pd.DataFrame,
-                             complex_condition: str) -> pd.Series:
+                             complex_condition: str,
+                             engine: str = None) -> pd.Series:
     """
     Function that evaluates complex logical conditions, where there are operators & and
     |, grouped in parentheses.
@@ -175,14 +391,19 @@ def evaluate_condition(df: pd.DataFrame,
         complex logical condition.
         examples of complex_condition = "(year == 1978 & country == 'Chile') | (year == 1978 & country == 'Argentina')",
         "(inlist(country, 'Chile', 'Argentina') | country == 'Bolivia) | (year == 2000)"
+    engine : str, optional (default=None)
+        Backend used to evaluate the condition. None evaluates the individual
+        conditions with pandas, short-circuiting on the rows already decided.
+        "numexpr" fuses the condition into a single multithreaded numexpr
+        expression, useful for very large DataFrames (requires numexpr). It
+        only applies to purely numeric conditions (numeric columns compared
+        with numbers), other conditions use the default evaluator.
     Returns
     -------
     pd.Series
         Boolean series of the evaluated complex condition
     """
 
-    # Create a copy of the original DataFrame
-    df = df.copy()
     # Normalize text in complex_condition
     complex_condition = normalize_text(complex_condition)
     # Split to separate the () blocks by ")&(" and ")|("
@@ -193,17 +414,19 @@ def evaluate_condition(df: pd.DataFrame,
     # Retrieve orderly & and |
     operators = re.findall(r'\)\s*([&|])\s*\(', complex_condition)
 
-    # Evaluate the conditions in each () block
+    if engine == 'numexpr':
+        result = _numexpr_condition(df, parts, operators)
+        if result is not None:
+            return pd.Series(result, index=df.index)
+    elif engine is not None:
+        raise ValueError(f"Unrecognized engine: {engine}")
 
-    parts_results = [compile_conditions(df, p) for p in parts]
+    # Each () block is evaluated only on the rows still undecided by the other blocks
+    def block(p):
+        # Parse the block up front to raise errors eagerly
+        atoms, ops = _split_conditions(df, p)
+        return (re.sub(r'\s+', ' ', p).strip(), 0.5,
+                lambda rows: _compile_conditions(atoms, ops, rows))
 
-    # Compute condition of the results in each ()
-    result = parts_results[0]
-    i = 1
-    for o in operators:
-        if o == "&":
-            result &= parts_results[i]
-        if o == "|":
-            result |= parts_results[i]
-        i += 1
-    return result
\ No newline at end of file
+    result = _short_circuit([block(p) for p in parts], operators, len(df))
+    return pd.Series(result, index=df.index)
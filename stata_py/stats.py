@@ -1,9 +1,27 @@
 
 import pandas as pd
+import numpy as np
+import re
 from typing import Union, List
 from  .control import evaluate_condition
-from openpyxl.styles import Border, Side, Alignment, PatternFill, Font
-from  .tools import dic_stats
+from  .tools import dic_stats, parse_stats
+
+# Define operations handled in stats
+OPER =  [
+    'sum',      # Sum of elements
+    'mean',     # Compute the arithmetic mean
+    'median',   # Compute the median
+    'min',      # Find the minimum value
+    'max',      # Find the maximum value
+    'prod',     # Compute the product of elements
+    'std',      # Compute the standard deviation
+    'var',      # Compute the variance
+    'count',    # Count the number of non-null elements
+    'nunique',  # Count the number of unique elements
+    'first',    # Get the first non-null element
+    'last',     # Get the last non-null element
+    'p1/p100'   # Compute the percentile
+    ]
 
 
 def tab(df: pd.DataFrame, 
@@ -16,7 +34,8 @@ def tab(df: pd.DataFrame,
         total: bool = False,
         if_stata: str = None,
         percent: str = None,
-        w: pd.Series = None) -> pd.DataFrame:
+        w: pd.Series = None,
+        engine: str = None) -> pd.DataFrame:
  
     """
     Function that replicates the tabulation function, providing a table with counts and percentages.
@@ -45,6 +64,8 @@ def tab(df: pd.DataFrame,
         Control mode percentage with the options: "col", "row", or "cell".
     w : pd.Series, optional (default=None)
         Expansion factor, typically used for weighted survey data.
+    engine : str, optional (default=None)
+        Backend to evaluate if_stata, "numexpr" fuses the condition in a single numexpr expression.
 
     Returns
     -------
@@ -88,7 +109,7 @@ def tab(df: pd.DataFrame,
             
     # Handle missing if_stata condition
     if if_stata:
-        df = df[evaluate_condition(df,if_stata)]
+        df = df[evaluate_condition(df,if_stata,engine=engine)]
     
     # Handle missing option
     if missing:
@@ -151,7 +172,8 @@ def table(df: pd.DataFrame,
           pivot:bool = True,
           round_decimals: int = 2,
           if_stata: str = None,
-          w: pd.Series = None) -> pd.DataFrame:
+          w: pd.Series = None,
+          engine: str = None) -> pd.DataFrame:
 
     """
     Generates a table that computes various statistics based on the given variables.
@@ -172,6 +194,8 @@ def table(df: pd.DataFrame,
         Control conditions, following the syntax used in Stata.
     w : pd.Series, optional (default=None)
         Expansion factor, typically used in survey-weighted data.
+    engine : str, optional (default=None)
+        Backend to evaluate if_stata, "numexpr" fuses the condition in a single numexpr expression.
 
     Returns
     -------
@@ -210,27 +234,10 @@ def table(df: pd.DataFrame,
 
     # Handle missing if_stata condition
     if if_stata:
-        df = df[evaluate_condition(df,if_stata)]
-
-    # Define operations
-    oper =  [
-    'sum',      # Sum of elements
-    'mean',     # Compute the arithmetic mean
-    'median',   # Compute the median
-    'min',      # Find the minimum value
-    'max',      # Find the maximum value
-    'prod',     # Compute the product of elements
-    'std',      # Compute the standard deviation
-    'var',      # Compute the variance
-    'count',    # Count the number of non-null elements
-    'nunique',  # Count the number of unique elements
-    'first',    # Get the first non-null element
-    'last',     # Get the last non-null element
-    'p1/p100'   # Compute the percentile
-    ]
+        df = df[evaluate_condition(df,if_stata,engine=engine)]
 
     # Translate stats to dict for evalute in .agg
-    dic=  dic_stats(stats, oper)
+    dic=  dic_stats(stats, OPER)
     
     # Handle missing w condition
     #stats_var = list(mi_diccionario.keys())
@@ -263,6 +270,7 @@ def table(df: pd.DataFrame,
 
 def count(df: pd.DataFrame, 
           if_stata: str = None,
+          engine: str = None,
           ) ->int:
 
     """
@@ -274,6 +282,8 @@ def count(df: pd.DataFrame,
         The DataFrame for which to count the rows.
     if_stata : str, optional (default=None)
         Control conditions to filter the DataFrame before counting rows, following the syntax used in Stata.
+    engine : str, optional (default=None)
+        Backend to evaluate if_stata, "numexpr" fuses the condition in a single numexpr expression.
 
     Returns
     -------
@@ -289,7 +299,7 @@ def count(df: pd.DataFrame,
     
     # Handle missing if_stata condition
     if if_stata:
-        df = df[evaluate_condition(df,if_stata)]
+        df = df[evaluate_condition(df,if_stata,engine=engine)]
 
     n = len(df)
     
@@ -297,6 +307,120 @@ def count(df: pd.DataFrame,
 
 
 
+def _group_codes(df: pd.DataFrame, 
+                 var: List[str]) -> tuple:
+    # Factorize the variables into a single code per group, -1 if any variable is missing
+    codes = None
+    for v in var:
+        c, uniques = pd.factorize(df[v])
+        if codes is None:
+            codes = c.astype(np.int64)
+        else:
+            codes = np.where((codes < 0) | (c < 0), -1, codes * len(uniques) + c)
+            # Keep the codes compact to avoid overflow with many variables
+            valid = codes >= 0
+            codes[valid] = pd.factorize(codes[valid])[0]
+    return codes, int(codes.max()) + 1 if len(codes) else 0
+
+
+
+def egen(df: pd.DataFrame, 
+         var: Union[str, List[str]], 
+         stats: str,
+         if_stata: str = None,
+         replace: bool = False,
+         engine: str = None) -> pd.DataFrame:
+
+    """
+    Replicates egen with by(), adding to df one column per statistic with the
+    statistic of the group of each row.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Dataframe on which to evaluate the function, the new columns are added to it.
+    var : Union[str, List[str]]
+        Variables from df defining the groups. Can be a string or a list of strings.
+    stats : str
+        Statistics to be calculated, with the same syntax and operations as table.
+    if_stata : str, optional (default=None)
+        Control conditions, following the syntax used in Stata. Only the rows
+        satisfying them are used in the statistics and receive a value.
+    replace : bool, optional (default=False)
+        If True, replaces the columns that already exist in df.
+    engine : str, optional (default=None)
+        Backend to evaluate if_stata, "numexpr" fuses the condition in a single numexpr expression.
+
+    Returns
+    -------
+    pd.DataFrame
+        The same df, with the new columns named "{column}_{statistic}", e.g. "lifeExp_mean", "gdpPercap_p90".
+
+    Raises
+    ------
+    TypeError
+        If df is not a DataFrame or var is not a string or a list of strings.
+    ValueError
+        If a new column already exists in df and replace is False.
+
+    Notes
+    -----
+    - The statistics are computed on the factorized codes of var and assigned to each row
+      by indexing with its code, without merging or copying df.
+    - Rows with missing values in var, or not satisfying if_stata, get missing values.
+    - Percentiles skip missing values, as in Stata and table.
+
+    """
+    
+    # Check if the df is a pandas DataFrame
+    if not isinstance(df, pd.DataFrame):
+        raise TypeError("df must be a pandas DataFrame")
+
+    # Check if var is a list of strings or a single string
+    if isinstance(var, list):
+        if not var or not all(isinstance(item, str) for item in var):
+            raise TypeError("var must be a string or a list of strings")
+    elif not isinstance(var, str):
+        raise TypeError("var must be a string or a list of strings")
+   
+    # Convert var to a list if it's a string
+    if isinstance(var, str):
+        var = [var]
+
+    # Translate stats to {column: [operations]}
+    dic = parse_stats(stats, OPER)
+    names = {(c, op): f'{c}_{op}' for c, ops in dic.items() for op in ops}
+    if not replace:
+        existing = [n for n in names.values() if n in df.columns]
+        if existing:
+            raise ValueError(f"Columns already exist in df: {existing}")
+
+    # Group of each row, -1 if any variable in var is missing
+    codes, ngroups = _group_codes(df, var)
+
+    # Handle missing if_stata condition
+    selected = codes >= 0
+    if if_stata:
+        selected &= evaluate_condition(df, if_stata, engine=engine).to_numpy()
+    group = codes[selected]
+    # Rows excluded index the extra missing position ngroups
+    take = np.where(selected, codes, ngroups)
+    positions = np.arange(ngroups + 1)
+
+    # Compute stats by group code and broadcast them to the rows
+    for c, ops in dic.items():
+        grouped = df[c][selected].groupby(group)
+        for op in ops:
+            if re.fullmatch(r'p\d+', op):
+                result = grouped.quantile(int(op[1:]) / 100)
+            else:
+                result = grouped.agg(op)
+            df[names[(c, op)]] = result.reindex(positions).to_numpy()[take]
+
+    return df
+
+
+
 def to_excel(data: Union[pd.DataFrame, 
                   List[pd.DataFrame]], path: str, 
                   sheet_names: List[str] = None) -> None:
@@ -322,6 +446,9 @@ def to_excel(data: Union[pd.DataFrame,
     for writing the Excel file.
     """
     
+    # openpyxl is only imported when writing Excel files
+    from openpyxl.styles import Border, Side, Alignment, PatternFill, Font
+
     # If a single DataFrame is passed, convert it into a list with one element
     if isinstance(data, pd.DataFrame):
         data = [data]
@@ -372,6 +499,6 @@ def to_excel(data: Union[pd.DataFrame,
                     cell.font = white_font
 
     # Save the Excel file
-    writer.save()
+    writer.close()
 
     
\ No newline at end of file
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the coalescing, cancellation and concurrency limit of stata_py.aio.
+
+Run with: pytest stata_py/test_aio.py
+"""
+import asyncio
+import threading
+import time
+import numpy as np
+import pandas as pd
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from stata_py import aio, stats
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({'a': np.arange(100) % 7, 'c': np.arange(100) % 3})
+
+
+@pytest.fixture(autouse=True)
+def reset():
+    aio.configure()
+    yield
+    aio.configure()
+    assert not aio._inflight
+
+
+class Calls:
+    # Wraps a function counting the calls and the calls running at a time
+
+    def __init__(self, function, delay=0.0):
+        self.function = function
+        self.delay = delay
+        self.calls = 0
+        self.running = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+        self.__name__ = function.__name__
+
+    def __call__(self, **kwargs):
+        with self.lock:
+            self.calls += 1
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        try:
+            time.sleep(self.delay)
+            return self.function(**kwargs)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+def test_coalesced_calls_run_once(df, monkeypatch):
+    calls = Calls(stats.table, delay=0.05)
+    monkeypatch.setattr(aio, '_table', calls)
+
+    async def main():
+        return await asyncio.gather(*[aio.table(df, 'c', 'mean a', if_stata='a > 3')
+                                      for _ in range(10)])
+
+    results = asyncio.run(main())
+    assert calls.calls == 1
+    expected = stats.table(df, 'c', 'mean a', if_stata='a > 3')
+    assert all(r.equals(expected) for r in results)
+    # Each caller receives its own DataFrame
+    assert len({id(r) for r in results}) == len(results)
+
+
+def test_cancel_one_of_two_waiters(df, monkeypatch):
+    calls = Calls(stats.count, delay=0.2)
+    monkeypatch.setattr(stats, 'count', calls)
+
+    async def main():
+        first = asyncio.create_task(aio.count(df, if_stata='a > 3'))
+        second = asyncio.create_task(aio.count(df, if_stata='a > 3'))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == (df.a > 3).sum()
+    assert calls.calls == 1
+
+
+def test_cancel_only_waiter_then_same_request(df, monkeypatch):
+    calls = Calls(stats.count, delay=0.1)
+    monkeypatch.setattr(stats, 'count', calls)
+
+    async def main():
+        first = asyncio.create_task(aio.count(df, if_stata='a > 3'))
+        await asyncio.sleep(0.02)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        # The same request right after starts a new computation
+        return await aio.count(df, if_stata='a > 3')
+
+    assert asyncio.run(main()) == (df.a > 3).sum()
+    assert calls.calls == 2
+
+
+def test_max_concurrency_with_cancellations(df, monkeypatch):
+    calls = Calls(stats.count, delay=0.2)
+    monkeypatch.setattr(stats, 'count', calls)
+    executor = ThreadPoolExecutor(16)
+    aio.configure(executor=executor, max_concurrency=2)
+
+    async def main():
+        tasks = [asyncio.create_task(aio.count(df, if_stata=f'a > {i}')) for i in range(8)]
+        await asyncio.sleep(0.05)
+        # Cancel two requests already running in the executor
+        tasks[0].cancel()
+        tasks[1].cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        return results
+
+    results = asyncio.run(main())
+    executor.shutdown(wait=True)
+    assert isinstance(results[0], asyncio.CancelledError)
+    assert isinstance(results[1], asyncio.CancelledError)
+    assert results[2:] == [(df.a > i).sum() for i in range(2, 8)]
+    assert calls.peak <= 2
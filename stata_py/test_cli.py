@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the stata-py command line entry point on a temporary csv file.
+
+Run with: pytest stata_py/test_cli.py
+"""
+import argparse
+import io
+import numpy as np
+import pandas as pd
+import pytest
+from stata_py import cli
+
+
+@pytest.fixture
+def data(tmp_path):
+    rng = np.random.default_rng(0)
+    n = 300
+    df = pd.DataFrame({'continent': rng.choice(['Asia', 'Europe', 'Africa'], n),
+                       'year': rng.integers(1990, 2010, n),
+                       'lifeExp': rng.random(n) * 80,
+                       'pop': rng.integers(0, 10**9, n),
+                       'unused': rng.random(n)})
+    path = tmp_path / 'data.csv'
+    df.to_csv(path, index=False)
+    return str(path), df
+
+
+def test_count(data, capsys):
+    path, df = data
+    assert cli.main(['count', path, '--if', 'year >= 2000 & pop > 100000000']) == 0
+    expected = ((df.year >= 2000) & (df['pop'] > 100000000)).sum()
+    assert capsys.readouterr().out.strip() == str(expected)
+
+
+def test_tab_two_variables_csv(data, capsys):
+    path, df = data
+    assert cli.main(['tab', path, 'continent', 'year', '--format', 'csv']) == 0
+    result = pd.read_csv(io.StringIO(capsys.readouterr().out))
+    expected = pd.crosstab(df.continent, df.year)
+    assert list(result.continent) == list(expected.index)
+    assert result.drop(columns='continent').to_numpy().tolist() == expected.to_numpy().tolist()
+
+
+def test_table_percentile(data, capsys):
+    path, df = data
+    assert cli.main(['table', path, 'continent', '--stats', 'mean lifeExp p90 pop',
+                     '--format', 'csv', '--round', '4']) == 0
+    result = pd.read_csv(io.StringIO(capsys.readouterr().out)).set_index('continent')
+    grouped = df.groupby('continent')
+    assert np.allclose(result.iloc[:, 0], grouped.lifeExp.mean().round(4))
+    assert np.allclose(result.iloc[:, 1], grouped['pop'].quantile(0.9).round(4))
+
+
+def test_missing_column(data, capsys):
+    path, _ = data
+    assert cli.main(['tab', path, 'nope']) == 1
+    assert capsys.readouterr().err.startswith('stata-py: error:')
+    assert cli.main(['count', path, '--if', 'nope > 3']) == 1
+    assert capsys.readouterr().err.startswith('stata-py: error:')
+
+
+def test_load_reads_needed_columns(data):
+    path, _ = data
+    args = argparse.Namespace(path=path, if_stata="year >= 2000 & continent != 'lifeExp'")
+    df = cli._load(args, ['continent'])
+    # Columns in --if are read, quoted values are not taken as columns
+    assert list(df.columns) == ['continent', 'year']
+    args = argparse.Namespace(path=path, if_stata="inrange(pop, 1, 100) | lifeExp < 50")
+    assert list(cli._load(args, ['year']).columns) == ['year', 'lifeExp', 'pop']
+    # count without --if reads a single column
+    args = argparse.Namespace(path=path, if_stata=None)
+    assert list(cli._load(args, []).columns) == ['continent']
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Checks compile_conditions and evaluate_condition against a straightforward
+evaluation with full masks, combined from left to right.
+
+Run with: python -m stata_py.test_control (or pytest)
+"""
+import random
+import re
+import numpy as np
+import pandas as pd
+from stata_py import control
+from stata_py.control import condition, compile_conditions, evaluate_condition, normalize_text
+
+ATOMS = ["a == 3", "a >= 5", "b < 20", "b != 7", "inrange(b, 10, 60)",
+         "inlist(a, 1, 2, 9)", "c == 'Chile'", "c != 'Peru'",
+         "inlist(c, 'Chile', 'Bolivia')", "a < 1", "b <= 30", "a > 8"]
+
+# normalize_text does not handle inlist/inrange inside () blocks
+BLOCK_ATOMS = [a for a in ATOMS if '(' not in a]
+
+
+def make_data(n: int = 2000) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'a': rng.integers(0, 10, n),
+                       'b': rng.integers(0, 100, n).astype(float),
+                       'c': rng.choice(['Chile', 'Peru', 'Bolivia'], n)},
+                      index=rng.permutation(n) + 7)
+    df.loc[df.index[:50], 'b'] = np.nan
+    return df
+
+
+def full_compile(df, complex_condition):
+    # Every condition over all the rows, combined from left to right
+    parts = re.split(r'\s*(&|\|)\s*', complex_condition)
+    result = condition(df, parts[0].strip()).to_numpy(dtype=bool)
+    for o, c in zip(parts[1::2], parts[2::2]):
+        mask = condition(df, c.strip()).to_numpy(dtype=bool)
+        result = result & mask if o == '&' else result | mask
+    return result
+
+
+def full_evaluate(df, complex_condition):
+    # Every () block over all the rows, combined from left to right
+    complex_condition = normalize_text(complex_condition)
+    parts = re.split(r'\)\s*\|\s*\(|\)\s*&\s*\(', complex_condition)
+    if len(parts) > 1:
+        parts[0] = parts[0][1:]
+        parts[-1] = parts[-1][0:-1]
+    operators = re.findall(r'\)\s*([&|])\s*\(', complex_condition)
+    result = full_compile(df, parts[0])
+    for o, p in zip(operators, parts[1:]):
+        mask = full_compile(df, p)
+        result = result & mask if o == '&' else result | mask
+    return result
+
+
+def random_condition(rng, k, atoms=ATOMS):
+    atoms = [rng.choice(atoms) for _ in range(k)]
+    return atoms[0] + ''.join(f' {rng.choice("&|")} {a}' for a in atoms[1:])
+
+
+def test_compile_conditions():
+    df = make_data()
+    rng = random.Random(1)
+    for _ in range(500):
+        text = random_condition(rng, rng.randint(1, 6))
+        expected = full_compile(df, text)
+        # Twice, the second time with the selectivity learned in the first
+        for _ in range(2):
+            result = compile_conditions(df, text)
+            assert result.index.equals(df.index)
+            assert np.array_equal(result.to_numpy(), expected), text
+
+
+def test_runs():
+    # Runs of the same operator are reordered, changes of operator are not
+    df = make_data()
+    for text in ["a == 3 & b < 20 & c == 'Chile' | a > 8 | b <= 30 & c != 'Peru'",
+                 "a >= 5 | b < 20 & inlist(a, 1, 2, 9) & c == 'Chile' | a < 1",
+                 "c != 'Peru' & c != 'Peru' | b != 7 & b != 7"]:
+        for _ in range(3):
+            assert np.array_equal(compile_conditions(df, text).to_numpy(),
+                                  full_compile(df, text)), text
+
+
+def test_evaluate_condition():
+    df = make_data()
+    rng = random.Random(2)
+    evaluated = 0
+    for _ in range(500):
+        blocks = [random_condition(rng, rng.randint(1, 3), BLOCK_ATOMS)
+                  for _ in range(rng.randint(1, 4))]
+        text = '(' + blocks[0] + ')' + ''.join(f' {rng.choice("&|")} ({b})' for b in blocks[1:])
+        try:
+            expected = full_evaluate(df, text)
+        except ValueError:
+            # Combinations of blocks not handled by normalize_text
+            continue
+        for _ in range(2):
+            result = evaluate_condition(df, text)
+            assert np.array_equal(result.to_numpy(), expected), text
+        evaluated += 1
+    assert evaluated > 300
+
+
+def test_numexpr_engine():
+    # The numexpr engine gives the same result as the default engine
+    df = make_data()
+    rng = random.Random(3)
+    for _ in range(300):
+        text = random_condition(rng, rng.randint(1, 6), BLOCK_ATOMS)
+        blocks = [random_condition(rng, rng.randint(1, 3), BLOCK_ATOMS)
+                  for _ in range(rng.randint(1, 4))]
+        blocked = '(' + blocks[0] + ')' + ''.join(f' {rng.choice("&|")} ({b})' for b in blocks[1:])
+        for t in (text, blocked):
+            try:
+                expected = evaluate_condition(df, t)
+            except ValueError:
+                continue
+            result = evaluate_condition(df, t, engine='numexpr')
+            assert result.index.equals(df.index)
+            assert np.array_equal(result.to_numpy(), expected.to_numpy()), t
+
+
+def test_numexpr_fallback():
+    # Columns and values numexpr does not handle fall back to the default engine
+    df = make_data(200)
+    df['n'] = pd.array(np.where(np.arange(200) % 7 == 0, None, np.arange(200) % 10), dtype='Int64')
+    df['f'] = np.arange(200) % 3 == 0
+    df['u'] = (np.arange(200) % 10).astype('uint64')
+    df['s'] = df['c'].astype('string')
+    for text in ["n > 4", "n == 3 | a < 2", "f == 1 & a > 3", "u >= 5 & b < 50",
+                 "s == 'Chile' & a > 2", "s != 'Peru' | u == 1",
+                 # evaluate_condition only takes inlist/inrange on their own
+                 "inlist(s, 'Chile', 'Peru')", "inlist(u, 1, 3)", "inrange(n, 2, 6)",
+                 "inlist(a, 1, 2, 9)", "inrange(b, 10, 60)"]:
+        expected = evaluate_condition(df, text)
+        result = evaluate_condition(df, text, engine='numexpr')
+        assert np.array_equal(result.to_numpy(), expected.to_numpy()), text
+    # Only purely numeric conditions over numpy numeric columns are fused
+    for text in ["n > 4", "f == 1", "u >= 5", "s == 'Chile'", "a > 2 & c == 'Chile'"]:
+        assert control._numexpr_condition(df, [text], []) is None, text
+    for text in ["a > 2 & b < 50", "inlist(a, 1, 2, 9)", "inrange(b, 10, 60)"]:
+        assert control._numexpr_condition(df, [text], []) is not None, text
+    # Non numeric values raise in both engines
+    for text in ["a < 1.5", "a > 2 & b < 1.5"]:
+        for engine in (None, 'numexpr'):
+            try:
+                evaluate_condition(df, text, engine=engine)
+            except TypeError:
+                pass
+            else:
+                raise AssertionError(f"{text} should raise TypeError with engine={engine}")
+
+
+def test_errors_do_not_depend_on_data():
+    # A condition that raises on all the rows raises even if no row reaches it
+    df = make_data()
+    df['s'] = df['c']
+    for text in ["a > 100 & s > 3", "a >= 0 | s < 3", "a > 100 & b > 'x'"]:
+        for _ in range(2):
+            try:
+                compile_conditions(df, text)
+            except TypeError:
+                pass
+            else:
+                raise AssertionError(f"{text} should raise TypeError")
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            control._observed_selectivity.clear()
+            test()
+            print(name, 'ok')
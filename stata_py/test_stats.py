@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Checks egen against groupby(...).transform and the percentiles of table.
+
+Run with: pytest stata_py/test_stats.py
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from stata_py.stats import egen, table
+
+
+def make_data(n: int = 3000) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'g': rng.choice(['a', 'b', 'c', 'd'], n).astype(object),
+                       'h': rng.integers(0, 6, n),
+                       'x': rng.random(n) * 100,
+                       'y': rng.integers(0, 10, n).astype(float)},
+                      index=rng.permutation(n) * 3 + 11)
+    # Missing group keys and missing values
+    df.loc[df.index[::17], 'g'] = None
+    df.loc[df.index[::13], 'x'] = np.nan
+    return df
+
+
+def expected(df, var, column, op, selected):
+    # Statistic of the group of each selected row, missing for the other rows
+    grouped = df[selected].groupby(var)[column]
+    if op == 'p90':
+        values = grouped.transform(lambda s: s.quantile(0.9))
+    else:
+        values = grouped.transform(op)
+    return values.reindex(df.index).to_numpy(dtype=float)
+
+
+@pytest.mark.parametrize('var', ['g', ['g', 'h']])
+def test_egen_matches_transform(var):
+    df = make_data()
+    index = df.index.copy()
+    # h == 3 excludes whole groups
+    out = egen(df, var, 'mean x count x first y p90 x', if_stata='h != 3')
+    assert out is df
+    assert df.index.equals(index)
+
+    keys = [var] if isinstance(var, str) else var
+    selected = df[keys].notna().all(axis=1) & (df.h != 3)
+    for column, op in [('x', 'mean'), ('x', 'count'), ('y', 'first'), ('x', 'p90')]:
+        result = df[f'{column}_{op}'].to_numpy(dtype=float)
+        assert np.allclose(result, expected(df, var, column, op, selected), equal_nan=True), op
+        # Rows excluded by if_stata or with missing keys are missing
+        assert np.isnan(result[~selected.to_numpy()]).all()
+
+
+def test_egen_many_groups():
+    # Several variables with many values, re-factorized to keep the codes small
+    rng = np.random.default_rng(1)
+    n = 5000
+    df = pd.DataFrame({'u': rng.integers(0, 1000, n), 'v': rng.integers(0, 1000, n),
+                       'w': rng.integers(0, 1000, n), 'x': rng.random(n)})
+    egen(df, ['u', 'v', 'w'], 'mean x')
+    assert np.allclose(df['x_mean'], df.groupby(['u', 'v', 'w'])['x'].transform('mean'))
+
+
+def test_egen_replace():
+    df = make_data(100)
+    egen(df, 'g', 'mean x')
+    with pytest.raises(ValueError):
+        egen(df, 'g', 'mean x')
+    egen(df, 'g', 'mean x', if_stata='h > 2', replace=True)
+    assert np.isnan(df.loc[df.h <= 2, 'x_mean']).all()
+
+
+def test_egen_and_table_percentiles_agree():
+    df = make_data()
+    egen(df, 'g', 'p90 x')
+    t = table(df, 'g', 'p90 x', round_decimals=None).set_index('g')
+    first = df.dropna(subset=['g']).groupby('g')['x_p90'].first()
+    assert np.allclose(t.iloc[:, 0], first)
+
+
+def test_table_percentiles_use_their_own_q():
+    # Each percentile used the last q in the stats string
+    df = make_data()
+    t = table(df, 'g', 'p90 x p10 y', round_decimals=None).set_index('g')
+    grouped = df.groupby('g')
+    assert np.allclose(t.iloc[:, 0], grouped['x'].quantile(0.9))
+    assert np.allclose(t.iloc[:, 1], grouped['y'].quantile(0.1))
@@ -7,11 +7,12 @@ Created on Wed Aug 16 16:05:12 2023
 import numpy as np
 import re
 
-def dic_stats(stats: str, 
-              oper: list) -> dict:
+def parse_stats(stats: str, 
+                oper: list) -> dict:
     
     """
-    Function that translates stats from the tabulate to a dictionary for evaluation in agg.
+    Function that translates stats from the tabulate to a dictionary with the
+    names of the operations to compute on each column.
     ----------
         stats: str, stats instructions from the table command.
         oper: list, list with identification of the operations handled in
@@ -19,7 +20,7 @@ def dic_stats(stats: str,
     Returns
     -------
     dict
-        Dictionary with the transcription of table stats for evaluation in agg.
+        Dictionary {column: [operations]}, e.g. {"lifeExp": ["mean", "p90"]}.
     """
     
     oper = [re.sub("p1/p100", 'p[1-9]|p[1-9][0-9]|p100', item) for item in oper]
@@ -44,15 +45,36 @@ def dic_stats(stats: str,
                 inv_dict[c].append(op)
             else:
                 inv_dict[c] = [op]
+
+    return inv_dict
+
+def dic_stats(stats: str, 
+              oper: list) -> dict:
+    
+    """
+    Function that translates stats from the tabulate to a dictionary for evaluation in agg.
+    ----------
+        stats: str, stats instructions from the table command.
+        oper: list, list with identification of the operations handled in
+            stats from the table command.
+    Returns
+    -------
+    dict
+        Dictionary with the transcription of table stats for evaluation in agg.
+    """
+    
+    inv_dict = parse_stats(stats, oper)
                 
     # Itera sobre las claves y valores del diccionario para crear funcion de percentil
     for key, values in inv_dict.items():
         new_values = []
         for value in values:
-            # Si el valor empieza con 'p', extrae el número y crea una función lambda para el percentil
-            if value.startswith('p'):
+            # Si el valor es 'p' y un número, extrae el número y crea una función lambda para el percentil
+            # (q se fija como argumento por defecto, para que cada percentil use su propio valor,
+            # y se omiten los valores faltantes, como en Stata)
+            if re.fullmatch(r'p\d+', value):
                 percentile_value = int(value[1:])
-                new_values.append(lambda x: np.percentile(x, q=percentile_value))
+                new_values.append(lambda x, q=percentile_value: np.nanpercentile(x, q=q))
             else:
                 new_values.append(value)
         # Actualiza los valores en el diccionario